@@ -2,8 +2,15 @@
 FlowSync Backend - Real-time Collaborative Architecture Whiteboard
 """
 import asyncio
-import json
+import collections
+import functools
+import logging
+import logging.handlers
 import os
+import queue
+import re
+import time
+import uuid
 from datetime import datetime
 from typing import Dict, Optional
 from contextlib import asynccontextmanager
@@ -11,6 +18,7 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+import orjson
 import redis.asyncio as redis
 
 # Optional: Google Gemini integration
@@ -27,158 +35,547 @@ except ImportError:
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
-CHANNEL_NAME = "flowsync:broadcast"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+CORS_ORIGINS = tuple(
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000").split(",")
+    if origin.strip()
+)
+# Cap on concurrent Gemini calls, each of which occupies a worker thread
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+CHANNEL_NAME = "flowsync:broadcast"  # Per-room streams are `<CHANNEL_NAME>:<room_id>`
+DEFAULT_ROOM = "default"
+ROOM_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+INVALID_ROOM_CLOSE_CODE = 1008  # "Policy Violation"
+# Listeners start at the tail and never replay, so streams only need to
+# buffer entries between XADD and the next XREAD on other instances
+STREAM_MAXLEN = 1000  # Approximate cap on retained entries per room stream
+STREAM_TTL = 60  # Seconds an idle room stream lives after its last write
+STREAM_READ_COUNT = 100  # Max entries pulled per XREAD
+STREAM_BLOCK_MS = 1000  # XREAD returns as soon as entries arrive
+LISTENER_RETRY_MIN = 0.5  # Seconds; doubled after each failed XREAD
+LISTENER_RETRY_MAX = 10
+INSTANCES_KEY = "flowsync:instances"  # Sorted set: instance id -> last heartbeat
+INSTANCE_TTL = 5  # Seconds before a silent instance stops being counted
+HEARTBEAT_INTERVAL = 2
+SEND_QUEUE_MAXLEN = 256  # Pending non-cursor frames before a socket is closed
+SLOW_CONSUMER_CLOSE_CODE = 1013  # "Try Again Later"
+PUBLISH_BATCH_SIZE = 64  # Max stream entries written per pipeline
+PUBLISH_QUEUE_MAXSIZE = 10000  # Entries buffered for Redis before new ones are dropped
+
+
+# =============================================================================
+# Logging
+# =============================================================================
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues records unformatted. The stock prepare()
+    formats on the caller's thread; deferring it moves both formatting and
+    the stream write onto the listener thread. Only safe while log args
+    are immutable values (strings, numbers, exceptions).
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# Records are queued on the event loop and formatted and written by a
+# background thread, so logging never formats or blocks on stdout inside a handler
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+
+logger = logging.getLogger("flowsync")
+# getLevelName() maps known level names to ints; anything else falls back to INFO
+_log_level = logging.getLevelName(LOG_LEVEL)
+logger.setLevel(_log_level if isinstance(_log_level, int) else logging.INFO)
+logger.addHandler(_DeferredQueueHandler(_log_queue))
+logger.propagate = False
+
+
+# =============================================================================
+# Timestamps
+# =============================================================================
+
+# [iso string, epoch seconds it was formatted from]
+_ts_cache = ["", 0.0]
+
+
+def now_iso() -> str:
+    """Return the current UTC time as ISO 8601, reformatted at most once per ms."""
+    t = time.time()
+    # abs() so a backwards clock step (e.g. NTP) refreshes the cache too
+    if abs(t - _ts_cache[1]) > 0.001:
+        _ts_cache[1] = t
+        _ts_cache[0] = datetime.utcfromtimestamp(t).isoformat()
+    return _ts_cache[0]
+
+
+# =============================================================================
+# Per-socket Send Queue
+# =============================================================================
+
+class SendQueue:
+    """
+    Outbound frames for one WebSocket, delivered in FIFO order. Cursor moves
+    are latest-wins per sender: a newer one overwrites the pending frame in
+    place, so a slow socket holds at most one pending cursor per client.
+    """
+    
+    def __init__(self):
+        # Slots are [payload, cursor_key] lists so pending cursor frames can be overwritten
+        self._slots: collections.deque[list] = collections.deque()
+        self._cursor_slots: Dict[str, list] = {}
+        self._pending_other = 0
+        self._ready = asyncio.Event()
+    
+    def put(self, payload: str, cursor_key: Optional[str] = None) -> bool:
+        """
+        Queue a frame; frames with a cursor_key replace the pending one for
+        that key. Returns False if too many non-cursor frames are pending,
+        in which case the frame is not queued.
+        """
+        if cursor_key is not None:
+            slot = self._cursor_slots.get(cursor_key)
+            if slot is not None:
+                slot[0] = payload
+                return True
+            slot = [payload, cursor_key]
+            self._cursor_slots[cursor_key] = slot
+        else:
+            if self._pending_other >= SEND_QUEUE_MAXLEN:
+                return False
+            self._pending_other += 1
+            slot = [payload, None]
+        self._slots.append(slot)
+        self._ready.set()
+        return True
+    
+    async def get(self) -> str:
+        """Wait for and return the next frame to send."""
+        while not self._slots:
+            self._ready.clear()
+            await self._ready.wait()
+        payload, cursor_key = self._slots.popleft()
+        if cursor_key is None:
+            self._pending_other -= 1
+        else:
+            del self._cursor_slots[cursor_key]
+        return payload
 
 
 # =============================================================================
-# Connection Manager with Redis Pub/Sub
+# Connection Manager with Redis Streams
 # =============================================================================
 
 class ConnectionManager:
     """
-    Manages WebSocket connections and broadcasts messages using Redis Pub/Sub.
+    Manages WebSocket connections per room and broadcasts messages using
+    one Redis stream per room.
     """
     
     def __init__(self):
-        # Store list of websockets per client_id (handles React StrictMode double-connect)
-        self.active_connections: Dict[str, list[WebSocket]] = {}
-        self.client_colors: Dict[str, str] = {}
+        # room_id -> client_id -> websockets (handles React StrictMode double-connect)
+        self.active_connections: Dict[str, Dict[str, list[WebSocket]]] = {}
+        self.client_colors: Dict[str, Dict[str, str]] = {}
+        # Outbound queue and sender task for each socket
+        self._send_queues: Dict[WebSocket, SendQueue] = {}
+        self._senders: Dict[WebSocket, asyncio.Task] = {}
+        # Pre-encoded head of each client's cursor_move frame, per room
+        self._cursor_prefixes: Dict[str, Dict[str, bytes]] = {}
+        # Membership fields of each room's welcome frame, rebuilt lazily after joins/leaves
+        self._welcome_members: Dict[str, str] = {}
         self.redis_client: Optional[redis.Redis] = None
-        self.pubsub: Optional[redis.client.PubSub] = None
+        # Last entry id read from the stream of every room with local clients
+        self._last_ids: Dict[bytes, bytes] = {}
+        self._rooms_changed = asyncio.Event()
         self._listener_task: Optional[asyncio.Task] = None
         
+        # Identifies this backend instance in the stream and heartbeat keys
+        self.instance_id = uuid.uuid4().hex
+        self._instance_tag = self.instance_id.encode()
+        self._instance_count = 0
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        
+        # (stream, entry) pairs waiting for the publisher task to pipeline them
+        self._publish_queue: asyncio.Queue = asyncio.Queue(maxsize=PUBLISH_QUEUE_MAXSIZE)
+        self._publish_dropped = 0
+        
+        # Strong references to background tasks; the event loop only keeps weak ones
+        self._bg_tasks: set[asyncio.Task] = set()
+        
         # Predefined colors for client cursors
         self.colors = [
             "#FF6B6B", "#4ECDC4", "#45B7D1", "#96CEB4", 
             "#FFEAA7", "#DDA0DD", "#98D8C8", "#F7DC6F",
             "#BB8FCE", "#85C1E9", "#F8B500", "#00CED1"
         ]
-        self._color_index = 0
+        self._free_colors = collections.deque(self.colors)
     
-    def get_client_count(self) -> int:
-        """Return count of unique connected clients."""
-        return len(self.active_connections)
+    def get_client_count(self, room_id: Optional[str] = None) -> int:
+        """Return count of unique connected clients in a room, or across all rooms."""
+        if room_id is not None:
+            return len(self.active_connections.get(room_id, ()))
+        return sum(len(clients) for clients in self.active_connections.values())
     
     async def connect_redis(self):
         """Initialize Redis connection and start listening for broadcasts."""
-        self.redis_client = redis.from_url(REDIS_URL, decode_responses=True)
-        self.pubsub = self.redis_client.pubsub()
-        await self.pubsub.subscribe(CHANNEL_NAME)
-        self._listener_task = asyncio.create_task(self._redis_listener())
+        # Raw bytes: stream payloads go straight to orjson/WebSockets, parsed by hiredis
+        self.redis_client = redis.from_url(REDIS_URL, decode_responses=False)
+        await self._refresh_instances()
+        self._listener_task = self._spawn(self._redis_listener())
+        self._heartbeat_task = self._spawn(self._heartbeat())
+        self._spawn(self._publisher())
         print(f"✓ Connected to Redis at {REDIS_URL}")
     
     async def disconnect_redis(self):
         """Clean up Redis connections."""
-        if self._listener_task:
-            self._listener_task.cancel()
-            try:
-                await self._listener_task
-            except asyncio.CancelledError:
-                pass
-        if self.pubsub:
-            await self.pubsub.unsubscribe(CHANNEL_NAME)
-            await self.pubsub.close()
+        for task in self._bg_tasks:
+            task.cancel()
+        await asyncio.gather(*self._bg_tasks, return_exceptions=True)
         if self.redis_client:
+            await self.redis_client.zrem(INSTANCES_KEY, self.instance_id)
             await self.redis_client.close()
     
+    def _spawn(self, coro) -> asyncio.Task:
+        """Run a coroutine in the background, keeping it alive until it finishes."""
+        task = asyncio.create_task(coro)
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._bg_tasks.discard)
+        return task
+    
+    @staticmethod
+    def _stream_key(room_id: str) -> bytes:
+        """Return the Redis stream key carrying a room's broadcasts."""
+        return f"{CHANNEL_NAME}:{room_id}".encode()
+    
+    async def _stream_tail(self, room_id: str) -> Optional[bytes]:
+        """Return the id of a room stream's newest entry, or None without Redis."""
+        if not self.redis_client:
+            return None
+        latest = await self.redis_client.xrevrange(self._stream_key(room_id), count=1)
+        return latest[0][0] if latest else b"0-0"
+    
+    def _watch_room(self, room_id: str, tail_id: Optional[bytes]):
+        """Start reading a room's stream after tail_id."""
+        if tail_id is None:
+            return
+        self._last_ids[self._stream_key(room_id)] = tail_id
+        self._rooms_changed.set()
+    
+    def _unwatch_room(self, room_id: str):
+        """Stop reading a room's stream once it has no local clients."""
+        self._last_ids.pop(self._stream_key(room_id), None)
+    
+    async def _refresh_instances(self):
+        """Renew this instance's heartbeat and count the live instances."""
+        now = time.time()
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(INSTANCES_KEY, {self.instance_id: now})
+            pipe.zremrangebyscore(INSTANCES_KEY, "-inf", now - INSTANCE_TTL)
+            pipe.zcard(INSTANCES_KEY)
+            # Drop the whole set if every instance stops heartbeating
+            pipe.expire(INSTANCES_KEY, INSTANCE_TTL)
+            _, _, count, _ = await pipe.execute()
+        self._instance_count = count
+    
+    async def _heartbeat(self):
+        """Periodically refresh the instance count until cancelled."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self._refresh_instances()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("heartbeat_failed error=%s", e)
+    
+    async def _publisher(self):
+        """Write queued stream entries to Redis in pipelined batches."""
+        while True:
+            batch = [await self._publish_queue.get()]
+            while len(batch) < PUBLISH_BATCH_SIZE and not self._publish_queue.empty():
+                batch.append(self._publish_queue.get_nowait())
+            try:
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    for stream, fields in batch:
+                        pipe.xadd(stream, fields, maxlen=STREAM_MAXLEN, approximate=True)
+                    # Let streams of rooms nobody writes to anymore expire
+                    for stream in {stream for stream, _ in batch}:
+                        pipe.expire(stream, STREAM_TTL)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning("publish_failed entries=%d error=%s", len(batch), e)
+    
     async def _redis_listener(self):
-        """Listen for messages from Redis and broadcast to local WebSocket clients."""
-        try:
-            async for message in self.pubsub.listen():
-                if message["type"] == "message":
-                    data = json.loads(message["data"])
-                    sender_id = data.get("sender_id")
-                    await self._local_broadcast(data, exclude=sender_id)
-        except asyncio.CancelledError:
-            pass
-        except Exception as e:
-            print(f"Redis listener error: {e}")
+        """Read batches from the room streams and broadcast to local WebSocket clients."""
+        prefix_len = len(self._stream_key(""))
+        retry_delay = LISTENER_RETRY_MIN
+        while True:
+            if not self._last_ids:
+                self._rooms_changed.clear()
+                await self._rooms_changed.wait()
+                continue
+            try:
+                streams = await self.redis_client.xread(
+                    dict(self._last_ids),
+                    count=STREAM_READ_COUNT,
+                    block=STREAM_BLOCK_MS
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep listening through Redis blips; the heartbeat still
+                # advertises this instance, so giving up would go unnoticed
+                logger.warning("listener_read_failed retry_in=%.1fs error=%s", retry_delay, e)
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, LISTENER_RETRY_MAX)
+                continue
+            retry_delay = LISTENER_RETRY_MIN
+            
+            for stream, entries in streams:
+                # The room may have emptied while XREAD was blocking
+                if stream not in self._last_ids:
+                    continue
+                room_id = stream[prefix_len:].decode()
+                for entry_id, fields in entries:
+                    self._last_ids[stream] = entry_id
+                    # Our own entries were already delivered locally
+                    if fields.get(b"i") == self._instance_tag:
+                        continue
+                    # Routing metadata lives in its own fields; the payload
+                    # is forwarded as-is, never parsed
+                    sender = fields.get(b"s")
+                    payload = fields.get(b"d")
+                    if sender is None or payload is None:
+                        logger.warning("stream_entry_skipped id=%s", entry_id)
+                        continue
+                    sender_id = sender.decode() or None
+                    cursor_key = sender_id if fields.get(b"t") == b"cursor_move" else None
+                    self._local_broadcast(
+                        room_id, payload.decode(), exclude=sender_id, cursor_key=cursor_key
+                    )
     
-    async def _local_broadcast(self, data: dict, exclude: str = None):
-        """Send message to all locally connected WebSocket clients."""
-        for client_id, websockets in list(self.active_connections.items()):
+    def _local_broadcast(
+        self, room_id: str, payload: str, exclude: str = None, cursor_key: str = None
+    ):
+        """
+        Queue a pre-serialized message for a room's locally connected WebSocket clients.
+        Each socket's sender task delivers it, so a slow client never blocks the rest.
+        """
+        for client_id, websockets in self.active_connections.get(room_id, {}).items():
             if client_id != exclude:
-                dead_sockets = []
                 for ws in websockets:
-                    try:
-                        await ws.send_json(data)
-                    except Exception:
-                        dead_sockets.append(ws)
-                # Remove dead sockets
-                for ws in dead_sockets:
-                    if ws in self.active_connections.get(client_id, []):
-                        self.active_connections[client_id].remove(ws)
+                    send_queue = self._send_queues.get(ws)
+                    if send_queue is not None and not send_queue.put(payload, cursor_key):
+                        self._drop_lagging(ws)
+    
+    def _drop_lagging(self, websocket: WebSocket):
+        """
+        Close a socket whose queue overflowed instead of silently dropping state
+        changes; the client reconnects and the endpoint cleans up.
+        """
+        self._send_queues.pop(websocket, None)
+        sender = self._senders.pop(websocket, None)
+        if sender:
+            sender.cancel()
+        logger.warning("send_queue_overflow closing lagging socket")
+        self._spawn(self._close_socket(websocket, SLOW_CONSUMER_CLOSE_CODE))
+    
+    @staticmethod
+    async def _close_socket(websocket: WebSocket, code: int):
+        """Close a socket, ignoring errors if it is already gone."""
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+    
+    async def _sender(
+        self, room_id: str, client_id: str, websocket: WebSocket, send_queue: SendQueue
+    ):
+        """Drain one socket's send queue until it is cancelled or the socket dies."""
+        try:
+            while True:
+                await websocket.send_text(await send_queue.get())
+        except Exception:
+            # Remove dead socket; the endpoint's disconnect handles the rest
+            websockets = self.active_connections.get(room_id, {}).get(client_id, [])
+            if websocket in websockets:
+                websockets.remove(websocket)
+            self._send_queues.pop(websocket, None)
+            self._senders.pop(websocket, None)
+    
+    def _get_welcome_members(self, room_id: str) -> str:
+        """Return the cached membership fields of a room's welcome frame as a JSON fragment."""
+        members = self._welcome_members.get(room_id)
+        if members is None:
+            members = orjson.dumps({
+                "connected_clients": list(self.active_connections[room_id].keys()),
+                "total_clients": self.get_client_count(room_id),
+                "client_colors": self.client_colors[room_id]
+            }).decode()[1:-1]
+            self._welcome_members[room_id] = members
+        return members
     
     def _get_next_color(self) -> str:
-        """Assign a color to a new client."""
-        color = self.colors[self._color_index % len(self.colors)]
-        self._color_index += 1
+        """Assign a color to a new client, cycling through the palette."""
+        color = self._free_colors.popleft()
+        self._free_colors.append(color)
         return color
     
-    async def connect(self, client_id: str, websocket: WebSocket):
-        """Accept a new WebSocket connection."""
+    async def connect(self, room_id: str, client_id: str, websocket: WebSocket):
+        """Accept a new WebSocket connection into a room."""
         await websocket.accept()
         
-        is_new_client = client_id not in self.active_connections
+        if room_id not in self.active_connections:
+            # Resolve the tail first; the room is registered and watched together
+            # below, with no await in between, so a concurrent last-leave can't
+            # tear it down half-built
+            tail_id = await self._stream_tail(room_id)
+            if room_id not in self.active_connections:
+                self.active_connections[room_id] = {}
+                self.client_colors[room_id] = {}
+                self._cursor_prefixes[room_id] = {}
+                self._watch_room(room_id, tail_id)
+        
+        clients = self.active_connections[room_id]
+        colors = self.client_colors[room_id]
+        is_new_client = client_id not in clients
         
         if is_new_client:
-            self.active_connections[client_id] = []
-            self.client_colors[client_id] = self._get_next_color()
+            clients[client_id] = []
+            colors[client_id] = self._get_next_color()
+            self._cursor_prefixes[room_id][client_id] = orjson.dumps({
+                "type": "cursor_move",
+                "client_id": client_id,
+                "color": colors[client_id]
+            })[:-1]
+            self._welcome_members.pop(room_id, None)
         
-        self.active_connections[client_id].append(websocket)
+        clients[client_id].append(websocket)
+        send_queue = SendQueue()
+        self._send_queues[websocket] = send_queue
+        self._senders[websocket] = self._spawn(
+            self._sender(room_id, client_id, websocket, send_queue)
+        )
         
         # Only broadcast join if this is a new unique client
         if is_new_client:
-            print(f"✓ Client {client_id} connected. Total unique clients: {self.get_client_count()}")
+            logger.info(
+                "client_connected room_id=%s client_id=%s total=%d",
+                room_id, client_id, self.get_client_count(room_id)
+            )
             
-            # Notify all clients about the new connection
-            await self.broadcast({
+            # Notify the room about the new connection
+            await self.broadcast(room_id, {
                 "type": "client_joined",
                 "client_id": client_id,
-                "color": self.client_colors[client_id],
-                "total_clients": self.get_client_count(),
-                "timestamp": datetime.utcnow().isoformat()
+                "color": colors[client_id],
+                "total_clients": self.get_client_count(room_id),
+                "timestamp": now_iso()
             }, sender_id=client_id)
         
         # Send welcome to this specific socket
-        await websocket.send_json({
+        identity = orjson.dumps({
             "type": "welcome",
             "client_id": client_id,
-            "color": self.client_colors[client_id],
-            "connected_clients": list(self.active_connections.keys()),
-            "total_clients": self.get_client_count(),
-            "client_colors": self.client_colors
-        })
-    
-    async def disconnect(self, client_id: str, websocket: WebSocket):
-        """Remove a WebSocket connection."""
-        if client_id in self.active_connections:
-            if websocket in self.active_connections[client_id]:
-                self.active_connections[client_id].remove(websocket)
+            "color": colors[client_id]
+        }).decode()
+        send_queue.put(f"{identity[:-1]},{self._get_welcome_members(room_id)}}}")
+    
+    async def disconnect(self, room_id: str, client_id: str, websocket: WebSocket):
+        """Remove a WebSocket connection from a room."""
+        self._send_queues.pop(websocket, None)
+        sender = self._senders.pop(websocket, None)
+        if sender:
+            sender.cancel()
+        
+        clients = self.active_connections.get(room_id)
+        if clients is None or client_id not in clients:
+            return
+        
+        if websocket in clients[client_id]:
+            clients[client_id].remove(websocket)
+        
+        # Only fully remove client if no more sockets
+        if len(clients[client_id]) == 0:
+            del clients[client_id]
+            self.client_colors[room_id].pop(client_id, None)
+            self._cursor_prefixes[room_id].pop(client_id, None)
+            self._welcome_members.pop(room_id, None)
             
-            # Only fully remove client if no more sockets
-            if len(self.active_connections[client_id]) == 0:
-                del self.active_connections[client_id]
-                if client_id in self.client_colors:
-                    del self.client_colors[client_id]
-                
-                print(f"✗ Client {client_id} disconnected. Total unique clients: {self.get_client_count()}")
-                
-                # Notify others
-                await self.broadcast({
-                    "type": "client_left",
-                    "client_id": client_id,
-                    "total_clients": self.get_client_count(),
-                    "timestamp": datetime.utcnow().isoformat()
-                }, sender_id=client_id)
-    
-    async def broadcast(self, data: dict, sender_id: str = None):
-        """Broadcast message to all clients via Redis Pub/Sub."""
-        data["sender_id"] = sender_id
-        if self.redis_client:
-            await self.redis_client.publish(CHANNEL_NAME, json.dumps(data))
-        else:
-            await self._local_broadcast(data, exclude=sender_id)
+            logger.info(
+                "client_disconnected room_id=%s client_id=%s total=%d",
+                room_id, client_id, self.get_client_count(room_id)
+            )
+            
+            # Notify others
+            await self.broadcast(room_id, {
+                "type": "client_left",
+                "client_id": client_id,
+                "total_clients": self.get_client_count(room_id),
+                "timestamp": now_iso()
+            }, sender_id=client_id)
+            
+            # Drop the room once its last local client has left
+            if not clients:
+                del self.active_connections[room_id]
+                del self.client_colors[room_id]
+                del self._cursor_prefixes[room_id]
+                self._unwatch_room(room_id)
+    
+    def get_client_color(self, room_id: str, client_id: str) -> str:
+        """Return a client's cursor color, or a neutral fallback if unknown."""
+        return self.client_colors.get(room_id, {}).get(client_id, "#888888")
+    
+    async def broadcast(self, room_id: str, data: dict, sender_id: str = None):
+        """
+        Broadcast message to a room. Local clients are served directly;
+        the room's Redis stream is only used when other instances are alive.
+        """
+        message_type = data.get("type")
+        # The type is client-supplied and becomes a stream field; redis-py
+        # rejects non-string values and would fail the whole pipeline batch
+        if not isinstance(message_type, str):
+            message_type = ""
+        self._broadcast_payload(room_id, orjson.dumps(data), message_type, sender_id)
+    
+    def broadcast_cursor(self, room_id: str, client_id: str, x, y) -> bool:
+        """
+        Broadcast a cursor move by filling the client's pre-encoded frame,
+        skipping dict building and JSON encoding. Returns False if the
+        fast path doesn't apply and the caller should use broadcast().
+        """
+        prefix = self._cursor_prefixes.get(room_id, {}).get(client_id)
+        # Exact type check: bool is an int subclass but isn't a JSON number
+        if prefix is None or type(x) not in (int, float) or type(y) not in (int, float):
+            return False
+        payload = b'%s,"x":%r,"y":%r,"timestamp":"%s"}' % (prefix, x, y, now_iso().encode())
+        self._broadcast_payload(room_id, payload, "cursor_move", client_id)
+        return True
+    
+    def _broadcast_payload(
+        self, room_id: str, payload: bytes, message_type: str, sender_id: str = None
+    ):
+        """
+        Deliver a serialized message to a room locally and, when other
+        instances are alive, queue it for the room's Redis stream.
+        """
+        if self.redis_client and self._instance_count != 1:
+            try:
+                self._publish_queue.put_nowait((
+                    self._stream_key(room_id),
+                    {"i": self._instance_tag, "s": sender_id or "", "t": message_type, "d": payload}
+                ))
+            except asyncio.QueueFull:
+                # Redis is falling behind; shed load rather than grow without bound
+                self._publish_dropped += 1
+                if self._publish_dropped % 1000 == 1:
+                    logger.warning("publish_queue_full dropped=%d", self._publish_dropped)
+        cursor_key = sender_id if message_type == "cursor_move" else None
+        self._local_broadcast(
+            room_id, payload.decode(), exclude=sender_id, cursor_key=cursor_key
+        )
 
 
 # =============================================================================
@@ -191,10 +588,14 @@ manager = ConnectionManager()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler for startup and shutdown."""
+    _log_listener.start()
     await manager.connect_redis()
     
     if GEMINI_AVAILABLE and GOOGLE_API_KEY:
         genai.configure(api_key=GOOGLE_API_KEY)
+        # One long-lived model instance shared by all /analyze requests
+        app.state.gemini_model = genai.GenerativeModel('gemini-pro')
+        app.state.gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
         print("✓ Google Gemini configured")
     else:
         print("⚠ Google Gemini not configured (no API key)")
@@ -202,6 +603,7 @@ async def lifespan(app: FastAPI):
     yield
     
     await manager.disconnect_redis()
+    _log_listener.stop()
 
 
 app = FastAPI(
@@ -211,9 +613,11 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# CORSMiddleware passes non-HTTP scopes straight through, so WebSocket
+# handshakes never pay for it; explicit origins avoid per-request reflection
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -238,28 +642,62 @@ class AnalyzeResponse(BaseModel):
 # WebSocket Endpoint
 # =============================================================================
 
-@app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    """WebSocket endpoint for real-time collaboration."""
-    await manager.connect(client_id, websocket)
+@app.websocket("/ws/{room_id}/{client_id}")
+async def websocket_endpoint(websocket: WebSocket, room_id: str, client_id: str):
+    """WebSocket endpoint for real-time collaboration within a room."""
+    # The room id becomes part of a Redis key
+    if not ROOM_ID_PATTERN.fullmatch(room_id):
+        await websocket.close(code=INVALID_ROOM_CLOSE_CODE)
+        return
+    
+    await manager.connect(room_id, client_id, websocket)
     
     try:
         while True:
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            # Text and binary frames are both accepted; orjson parses either
+            raw = message.get("text") or message.get("bytes")
+            if not raw:
+                continue
+            try:
+                data = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                logger.debug("invalid_frame room_id=%s client_id=%s", room_id, client_id)
+                continue
+            if not isinstance(data, dict):
+                continue
             message_type = data.get("type")
             
+            if message_type == "cursor_move" and manager.broadcast_cursor(
+                room_id, client_id, data.get("x"), data.get("y")
+            ):
+                continue
+            
             data["client_id"] = client_id
-            data["color"] = manager.client_colors.get(client_id, "#888888")
-            data["timestamp"] = datetime.utcnow().isoformat()
+            data["color"] = manager.get_client_color(room_id, client_id)
+            data["timestamp"] = now_iso()
             
             # Only log non-cursor events to reduce noise
-            if message_type != "cursor_move":
-                print(f"← [{client_id}] {message_type}: {data.get('id', 'N/A')}")
+            if message_type != "cursor_move" and logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "message room_id=%s client_id=%s type=%s id=%s",
+                    room_id, client_id, message_type, data.get("id", "N/A")
+                )
             
-            await manager.broadcast(data, sender_id=client_id)
+            await manager.broadcast(room_id, data, sender_id=client_id)
             
     except WebSocketDisconnect:
-        await manager.disconnect(client_id, websocket)
+        pass
+    finally:
+        await manager.disconnect(room_id, client_id, websocket)
+
+
+@app.websocket("/ws/{client_id}")
+async def default_room_websocket_endpoint(websocket: WebSocket, client_id: str):
+    """WebSocket endpoint for clients that don't name a room."""
+    await websocket_endpoint(websocket, DEFAULT_ROOM, client_id)
 
 
 # =============================================================================
@@ -273,6 +711,7 @@ async def root():
         "service": "FlowSync API",
         "status": "running",
         "connected_clients": manager.get_client_count(),
+        "active_rooms": len(manager.active_connections),
         "redis_connected": manager.redis_client is not None,
         "gemini_configured": GEMINI_AVAILABLE and bool(GOOGLE_API_KEY)
     }
@@ -304,7 +743,7 @@ async def analyze_diagram(diagram: DiagramData):
     
     if not GOOGLE_API_KEY:
         return AnalyzeResponse(
-            analysis=generate_mock_analysis(diagram),
+            analysis=get_mock_analysis(diagram),
             timestamp=datetime.utcnow().isoformat()
         )
     
@@ -325,8 +764,8 @@ Architecture Diagram:
 {diagram_description}
 """
         
-        model = genai.GenerativeModel('gemini-pro')
-        response = await asyncio.to_thread(model.generate_content, prompt)
+        async with app.state.gemini_semaphore:
+            response = await asyncio.to_thread(app.state.gemini_model.generate_content, prompt)
         
         return AnalyzeResponse(
             analysis=response.text,
@@ -340,40 +779,63 @@ Architecture Diagram:
 
 def format_diagram_for_analysis(diagram: DiagramData) -> str:
     """Format the diagram data into a readable description for the AI."""
-    lines = ["## Nodes (Components):"]
+    node_count = len(diagram.nodes)
+    # Two headings, one line per node, one per edge (or the placeholder)
+    lines = [""] * (2 + node_count + max(len(diagram.edges), 1))
+    lines[0] = "## Nodes (Components):"
     
-    for node in diagram.nodes:
+    for i, node in enumerate(diagram.nodes, 1):
         node_type = node.get("type", "default")
         label = node.get("data", {}).get("label", "Unnamed")
         node_id = node.get("id", "unknown")
-        lines.append(f"- [{node_type}] {label} (id: {node_id})")
+        lines[i] = f"- [{node_type}] {label} (id: {node_id})"
     
-    lines.append("\n## Edges (Connections):")
+    lines[node_count + 1] = "\n## Edges (Connections):"
     
-    for edge in diagram.edges:
+    for i, edge in enumerate(diagram.edges, node_count + 2):
         source = edge.get("source", "?")
         target = edge.get("target", "?")
         label = edge.get("label", "connects to")
-        lines.append(f"- {source} --{label}--> {target}")
+        lines[i] = f"- {source} --{label}--> {target}"
     
     if not diagram.edges:
-        lines.append("- No connections defined")
+        lines[-1] = "- No connections defined"
     
     return "\n".join(lines)
 
 
+def get_mock_analysis(diagram: DiagramData) -> str:
+    """Return the mock analysis, reusing a cached report for identical diagrams."""
+    try:
+        key = orjson.dumps(diagram.model_dump(), option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        # orjson rejects ints wider than 64 bits, which are still valid JSON
+        return generate_mock_analysis(diagram)
+    return _cached_mock_analysis(key)
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_mock_analysis(diagram_json: bytes) -> str:
+    """Memoize mock analyses by canonical (key-sorted) diagram JSON."""
+    return generate_mock_analysis(DiagramData.model_validate_json(diagram_json))
+
+
 def generate_mock_analysis(diagram: DiagramData) -> str:
     """Generate a mock analysis when Gemini API is not available."""
     node_count = len(diagram.nodes)
     edge_count = len(diagram.edges)
     
     node_types = {}
+    has_database = has_api = False
     for node in diagram.nodes:
         ntype = node.get("type", "default")
         node_types[ntype] = node_types.get(ntype, 0) + 1
-    
-    has_database = any("database" in str(n).lower() or "db" in str(n).lower() for n in diagram.nodes)
-    has_api = any("api" in str(n).lower() or "gateway" in str(n).lower() for n in diagram.nodes)
+        
+        text = str(node).lower()
+        if not has_database and ("database" in text or "db" in text):
+            has_database = True
+        if not has_api and ("api" in text or "gateway" in text):
+            has_api = True
     
     analysis = f"""## 🔒 Security Analysis Report
 
@@ -438,4 +900,4 @@ def generate_mock_analysis(diagram: DiagramData) -> str:
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools", ws="websockets")
@@ -0,0 +1,30 @@
+"""
+Tests for the mock analysis and its per-diagram cache.
+"""
+from main import DiagramData, _cached_mock_analysis, generate_mock_analysis, get_mock_analysis
+
+
+def test_cached_analysis_matches_uncached():
+    diagram = DiagramData(
+        nodes=[{"id": "db", "type": "database", "data": {"label": "Postgres"}}],
+        edges=[{"source": "api", "target": "db"}],
+    )
+    assert get_mock_analysis(diagram) == generate_mock_analysis(diagram)
+
+
+def test_identical_diagrams_hit_the_cache():
+    _cached_mock_analysis.cache_clear()
+    first = DiagramData(nodes=[{"id": "a", "type": "service"}], edges=[])
+    # Same content, different key order
+    second = DiagramData(nodes=[{"type": "service", "id": "a"}], edges=[])
+    get_mock_analysis(first)
+    get_mock_analysis(second)
+    info = _cached_mock_analysis.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+
+def test_big_ints_fall_back_to_uncached_analysis():
+    _cached_mock_analysis.cache_clear()
+    diagram = DiagramData(nodes=[{"id": "a", "type": "database", "size": 2**70}], edges=[])
+    assert get_mock_analysis(diagram) == generate_mock_analysis(diagram)
+    assert _cached_mock_analysis.cache_info().currsize == 0
@@ -0,0 +1,125 @@
+"""
+Tests for ConnectionManager broadcasting without a Redis server.
+"""
+import asyncio
+import json
+
+import orjson
+from redis.connection import Encoder
+
+from main import ConnectionManager
+
+
+class FakeWebSocket:
+    """Minimal stand-in for a Starlette WebSocket that records sent frames."""
+
+    def __init__(self):
+        self.sent: list[str] = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+async def join(manager: ConnectionManager, room_id: str, client_id: str) -> FakeWebSocket:
+    """Connect a fake socket and let its sender task flush the welcome frame."""
+    websocket = FakeWebSocket()
+    await manager.connect(room_id, client_id, websocket)
+    await asyncio.sleep(0)
+    return websocket
+
+
+def test_non_string_type_still_publishes_and_delivers():
+    async def run():
+        manager = ConnectionManager()
+        alice = await join(manager, "r", "alice")
+        await join(manager, "r", "bob")
+        # Pretend other instances are alive so entries are queued for Redis
+        manager.redis_client = object()
+        manager._instance_count = 2
+        alice.sent.clear()
+
+        for bad_type in (True, [1], {"a": 1}):
+            await manager.broadcast("r", {"type": bad_type, "id": "n"}, sender_id="bob")
+        await asyncio.sleep(0)
+
+        entries = []
+        while not manager._publish_queue.empty():
+            entries.append(manager._publish_queue.get_nowait())
+        manager.redis_client = None
+        for task in manager._bg_tasks:
+            task.cancel()
+        return alice.sent, entries
+
+    delivered, entries = asyncio.run(run())
+    assert [orjson.loads(frame)["type"] for frame in delivered] == [True, [1], {"a": 1}]
+    assert len(entries) == 3
+    encoder = Encoder("utf-8", "strict", False)
+    for stream, fields in entries:
+        assert fields["t"] == ""
+        # Would raise DataError for a non-string type
+        for value in fields.values():
+            encoder.encode(value)
+
+
+def cursor_frames(*coords) -> tuple[list, list[str]]:
+    """Send cursor moves from bob and return the fast-path results and alice's frames."""
+    async def run():
+        manager = ConnectionManager()
+        alice = await join(manager, "r", "alice")
+        await join(manager, "r", "bob")
+        alice.sent.clear()
+        results = [manager.broadcast_cursor("r", "bob", x, y) for x, y in coords]
+        await asyncio.sleep(0)
+        for task in manager._bg_tasks:
+            task.cancel()
+        return results, alice.sent
+
+    return asyncio.run(run())
+
+
+def test_cursor_template_produces_valid_json():
+    results, frames = cursor_frames((12.5, 3))
+    assert results == [True]
+    frame = orjson.loads(frames[0])
+    assert frame["type"] == "cursor_move"
+    assert frame["client_id"] == "bob"
+    assert (frame["x"], frame["y"]) == (12.5, 3)
+    assert frame["color"] and frame["timestamp"]
+
+
+def test_cursor_template_rejects_non_numeric_coordinates():
+    results, frames = cursor_frames((True, 1), (1, False), ("1", 2), (None, 2))
+    assert results == [False, False, False, False]
+    assert frames == []
+
+
+def test_cursor_template_keeps_large_numbers_valid():
+    _, frames = cursor_frames((1e308, -1.5e-300))
+    frame = orjson.loads(frames[0])
+    assert (frame["x"], frame["y"]) == (1e308, -1.5e-300)
+
+    # Wider than orjson's 64-bit range but still valid JSON
+    _, frames = cursor_frames((2**70, 0))
+    assert json.loads(frames[0])["x"] == 2**70
+
+
+def test_cursor_template_escapes_client_id():
+    async def run():
+        manager = ConnectionManager()
+        alice = await join(manager, "r", "alice")
+        await join(manager, "r", 'b"o\\b')
+        alice.sent.clear()
+        manager.broadcast_cursor("r", 'b"o\\b', 1, 2)
+        await asyncio.sleep(0)
+        for task in manager._bg_tasks:
+            task.cancel()
+        return alice.sent
+
+    assert orjson.loads(asyncio.run(run())[0])["client_id"] == 'b"o\\b'
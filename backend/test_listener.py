@@ -0,0 +1,75 @@
+"""
+Tests for how the Redis stream listener handles entries, using a fake client.
+"""
+import asyncio
+
+import main
+from main import ConnectionManager
+
+STREAM = b"flowsync:broadcast:r"
+
+
+class FakeRedis:
+    """Serves scripted XREAD results, then blocks like an idle stream."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+
+    async def xread(self, streams, count, block):
+        if not self.results:
+            await asyncio.sleep(3600)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def listen(manager: ConnectionManager, redis_client: FakeRedis) -> list:
+    """Run the listener over the scripted results and return the local broadcasts."""
+    delivered = []
+
+    async def run():
+        manager.redis_client = redis_client
+        manager._last_ids[STREAM] = b"0-0"
+        manager._local_broadcast = lambda *args, **kwargs: delivered.append((args, kwargs))
+        task = asyncio.create_task(manager._redis_listener())
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(run())
+    return delivered
+
+
+def test_entries_from_other_instances_are_delivered():
+    manager = ConnectionManager()
+    entry = {b"i": b"other", b"s": b"bob", b"t": b"cursor_move", b"d": b'{"x":1}'}
+    delivered = listen(manager, FakeRedis([(STREAM, [(b"1-0", entry)])]))
+    assert delivered == [(("r", '{"x":1}'), {"exclude": "bob", "cursor_key": "bob"})]
+    assert manager._last_ids[STREAM] == b"1-0"
+
+
+def test_own_instance_entries_are_skipped():
+    manager = ConnectionManager()
+    entry = {b"i": manager._instance_tag, b"s": b"bob", b"t": b"node_move", b"d": b"{}"}
+    delivered = listen(manager, FakeRedis([(STREAM, [(b"1-0", entry)])]))
+    assert delivered == []
+    assert manager._last_ids[STREAM] == b"1-0"
+
+
+def test_entries_missing_fields_are_skipped():
+    manager = ConnectionManager()
+    entries = [
+        (b"1-0", {b"d": b"old envelope"}),
+        (b"2-0", {b"i": b"other", b"s": b"bob"}),
+        (b"3-0", {b"i": b"other", b"s": b"", b"t": b"client_left", b"d": b"{}"}),
+    ]
+    delivered = listen(manager, FakeRedis([(STREAM, entries)]))
+    assert delivered == [(("r", "{}"), {"exclude": None, "cursor_key": None})]
+
+
+def test_listener_survives_read_errors(monkeypatch):
+    monkeypatch.setattr(main, "LISTENER_RETRY_MIN", 0.001)
+    manager = ConnectionManager()
+    entry = {b"i": b"other", b"s": b"bob", b"t": b"node_move", b"d": b"{}"}
+    delivered = listen(manager, FakeRedis(ConnectionError("blip"), [(STREAM, [(b"1-0", entry)])]))
+    assert len(delivered) == 1
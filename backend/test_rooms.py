@@ -0,0 +1,74 @@
+"""
+Tests for room routing over the WebSocket endpoints, without a Redis server.
+"""
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import main
+
+
+@pytest.fixture(scope="module")
+def client():
+    """
+    Serve the app without Redis. Entering the client shares one event loop
+    across every socket, as in production.
+    """
+    async def skip_redis():
+        pass
+
+    patch = pytest.MonkeyPatch()
+    patch.setattr(main.manager, "connect_redis", skip_redis)
+    patch.setattr(main.manager, "disconnect_redis", skip_redis)
+    with TestClient(main.app) as test_client:
+        yield test_client
+    patch.undo()
+
+
+def test_rooms_are_isolated(client):
+    with client.websocket_connect("/ws/red/alice") as alice, \
+            client.websocket_connect("/ws/red/bob") as bob, \
+            client.websocket_connect("/ws/blue/carol") as carol:
+        assert alice.receive_json()["type"] == "welcome"
+        assert alice.receive_json()["client_id"] == "bob"
+        bob.receive_json()
+        welcome = carol.receive_json()
+        assert welcome["connected_clients"] == ["carol"]
+        assert welcome["total_clients"] == 1
+
+        carol.send_json({"type": "node_move", "id": "blue-node"})
+        bob.send_json({"type": "node_move", "id": "red-node"})
+        # Alice only ever sees traffic from her own room
+        assert alice.receive_json()["id"] == "red-node"
+
+
+def test_default_room_alias(client):
+    with client.websocket_connect(f"/ws/{main.DEFAULT_ROOM}/alice") as alice, \
+            client.websocket_connect("/ws/bob") as bob:
+        alice.receive_json()
+        assert alice.receive_json()["client_id"] == "bob"
+        assert bob.receive_json()["connected_clients"] == ["alice", "bob"]
+
+
+def test_invalid_room_id_is_rejected(client):
+    for room_id in ("x" * 65, "bad.room", "a%20b"):
+        with pytest.raises(WebSocketDisconnect) as exc:
+            with client.websocket_connect(f"/ws/{room_id}/alice"):
+                pass
+        assert exc.value.code == main.INVALID_ROOM_CLOSE_CODE
+
+
+def test_rooms_are_cleaned_up_after_malformed_frames(client):
+    with client.websocket_connect("/ws/green/alice") as alice, \
+            client.websocket_connect("/ws/green/bob") as bob:
+        alice.receive_json()
+        alice.receive_json()
+        bob.receive_json()
+        for frame in ("", "not json", "[1,2]"):
+            alice.send_text(frame)
+        alice.send_json({"type": "node_add", "id": "n"})
+        assert bob.receive_json()["id"] == "n"
+
+    assert main.manager.active_connections == {}
+    assert main.manager._senders == {}
+    assert main.manager._send_queues == {}
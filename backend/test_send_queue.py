@@ -0,0 +1,69 @@
+"""
+Tests for the per-socket SendQueue ordering and overflow behavior.
+"""
+import asyncio
+
+from main import SEND_QUEUE_MAXLEN, SendQueue
+
+
+async def drain(queue: SendQueue) -> list[str]:
+    """Return every frame currently pending in the queue."""
+    frames = []
+    while queue._slots:
+        frames.append(await queue.get())
+    return frames
+
+
+def test_frames_keep_fifo_order_across_kinds():
+    async def run():
+        queue = SendQueue()
+        queue.put("cursor bob", "bob")
+        queue.put("client_left bob")
+        return await drain(queue)
+
+    assert asyncio.run(run()) == ["cursor bob", "client_left bob"]
+
+
+def test_cursor_moves_are_latest_wins_per_sender():
+    async def run():
+        queue = SendQueue()
+        queue.put("cursor bob 1", "bob")
+        queue.put("node_add")
+        queue.put("cursor alice 1", "alice")
+        queue.put("cursor bob 2", "bob")
+        return await drain(queue)
+
+    assert asyncio.run(run()) == ["cursor bob 2", "node_add", "cursor alice 1"]
+
+
+def test_cursor_after_delivery_is_queued_again():
+    async def run():
+        queue = SendQueue()
+        queue.put("cursor bob 1", "bob")
+        first = await queue.get()
+        queue.put("cursor bob 2", "bob")
+        return [first] + await drain(queue)
+
+    assert asyncio.run(run()) == ["cursor bob 1", "cursor bob 2"]
+
+
+def test_put_reports_overflow_of_non_cursor_frames():
+    async def run():
+        queue = SendQueue()
+        accepted = [queue.put(f"frame {i}") for i in range(SEND_QUEUE_MAXLEN)]
+        overflow = queue.put("one too many")
+        cursor = queue.put("cursor bob", "bob")
+        return all(accepted), overflow, cursor
+
+    assert asyncio.run(run()) == (True, False, True)
+
+
+def test_get_waits_for_next_frame():
+    async def run():
+        queue = SendQueue()
+        waiter = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        queue.put("late")
+        return await waiter
+
+    assert asyncio.run(run()) == "late"
@@ -31,6 +31,9 @@ const generateClientId = () => {
 
 const CLIENT_ID = generateClientId();
 
+// Room to join, taken from the `?room=` query parameter
+const ROOM_ID = new URLSearchParams(window.location.search).get('room') || 'default';
+
 // =============================================================================
 // Initial Nodes and Edges
 // =============================================================================
@@ -332,7 +335,9 @@ const FlowCanvas = () => {
     if (wsRef.current?.readyState === WebSocket.OPEN) return;
     
     setConnectionStatus('connecting');
-    const ws = new WebSocket(`${WS_URL}/ws/${CLIENT_ID}`);
+    const ws = new WebSocket(
+      `${WS_URL}/ws/${encodeURIComponent(ROOM_ID)}/${encodeURIComponent(CLIENT_ID)}`
+    );
     
     ws.onopen = () => {
       console.log('✓ WebSocket connected');